@@ -0,0 +1,429 @@
+"""
+Module: cache_backends.py
+Description: This module defines a memcached cache backend for running the cache on several nodes.
+
+Keys are spread over the nodes with rendezvous (highest random weight) hashing, so adding or removing a
+node only moves the keys that belong to that node. A node that keeps failing is ejected for a while and
+its keys fall through to the next node in their ranking. Optionally, the hottest keys are also written to
+the next nodes of their ranking so they survive the loss or restart of their primary node.
+
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.memcached import PyMemcacheCache
+from django.utils.functional import cached_property
+from pymemcache.client.hash import HashClient
+from pymemcache.client.rendezvous import RendezvousHash
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class RankedRendezvousHash(RendezvousHash):
+    """
+    RendezvousHash that can also return the full ranking of nodes for a key.
+
+    Nodes are replaced rather than updated in place, so lookups running in other threads while a node is
+    ejected or revived see a consistent list.
+    """
+
+    def get_nodes(self, key, count):
+        """
+        Returns the count highest ranked nodes for a key, the first one being the node get_node returns.
+        """
+        ranked = sorted(
+            self.nodes,
+            key=lambda node: (self.hash_function(f"{node}-{key}"), str(node)),
+            reverse=True,
+        )
+        return ranked[:count]
+
+    def add_node(self, node):
+        if node not in self.nodes:
+            self.nodes = [*self.nodes, node]
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            raise ValueError(f"No such node {node} to remove")
+        self.nodes = [other for other in self.nodes if other != node]
+
+
+class LockedHashClient(HashClient):
+    """
+    HashClient whose node health bookkeeping is safe to share between threads.
+
+    HashClient updates its failed and dead node tables without locking, so two threads ejecting or
+    reviving the same node race and raise KeyError outside of the ignore_exc handling. Every change to
+    those tables goes through one lock here; the memcached commands themselves still run unlocked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.health_lock = threading.RLock()
+        super().__init__(*args, **kwargs)
+
+    def add_server(self, server, port=None):
+        with self.health_lock:
+            super().add_server(server, port)
+
+    def remove_server(self, server, port=None):
+        if port is not None:
+            server = (server, port)
+        with self.health_lock:
+            self._failed_clients.pop(server, None)
+            if server in self._dead_clients:
+                return
+            self._dead_clients[server] = time.time()
+            key = self._make_client_key(server)
+            if key in self.hasher.nodes:
+                self.hasher.remove_node(key)
+
+    def _retry_dead(self):
+        with self.health_lock:
+            super()._retry_dead()
+
+    def _mark_failed_server(self, server):
+        with self.health_lock:
+            # another thread may have ejected the node while this command was running
+            if server not in self._dead_clients:
+                super()._mark_failed_server(server)
+
+    def _check_server(self, server):
+        """
+        Returns whether a command can be sent to server: "up", "retry" when the server is failing but
+        due for another attempt, or "wait" when it is failing and not due yet.
+        """
+        with self.health_lock:
+            failed = self._failed_clients.get(server)
+            if failed is None:
+                return "up"
+            if failed["attempts"] >= self.retry_attempts:
+                logger.debug("marking server as dead: %s", server)
+                self.remove_server(server)
+                return "up"
+            if time.time() - failed["failed_time"] > self.retry_timeout:
+                return "retry"
+            return "wait"
+
+    def _recovered(self, server):
+        with self.health_lock:
+            self._failed_clients.pop(server, None)
+
+    def _safely_run_func(self, client, func, default_val, *args, **kwargs):
+        try:
+            state = self._check_server(client.server)
+            if state == "wait":
+                return default_val
+            result = func(*args, **kwargs)
+            if state == "retry":
+                self._recovered(client.server)
+            return result
+        except OSError:
+            self._mark_failed_server(client.server)
+            if not self.ignore_exc:
+                raise
+            return default_val
+        except Exception:
+            if not self.ignore_exc:
+                raise
+            return default_val
+
+    def _safely_run_set_many(self, client, values, *args, **kwargs):
+        succeeded = []
+        try:
+            state = self._check_server(client.server)
+            if state == "wait":
+                return values.keys()
+            succeeded, failed, err = self._set_many(client, values, *args, **kwargs)
+            if err is not None:
+                raise err
+            if state == "retry":
+                self._recovered(client.server)
+            return failed
+        except OSError:
+            self._mark_failed_server(client.server)
+            if not self.ignore_exc:
+                raise
+            return list(set(values.keys()) - set(succeeded))
+        except Exception:
+            if not self.ignore_exc:
+                raise
+            return list(set(values.keys()) - set(succeeded))
+
+    def get_health(self):
+        """
+        Returns the (failing, ejected) sets of node keys.
+        """
+        with self.health_lock:
+            return (
+                {self._make_client_key(server) for server in self._failed_clients},
+                {self._make_client_key(server) for server in self._dead_clients},
+            )
+
+
+class HotKeyTracker:
+    """
+    HotKeyTracker counts key reads over a fixed window to tell which keys are hot.
+
+    A key is hot once it has been read threshold times in the current window. Counts are reset at the end
+    of every window, which also bounds the memory used by the tracker.
+
+    The tracker also remembers which keys were written to replicas, until those copies expire, so that only
+    they need cleaning up once the key cools down.
+    """
+
+    _trackers = {}
+    _trackers_lock = threading.Lock()
+
+    def __init__(self, threshold, window):
+        self.threshold = threshold
+        self.window = window
+        self.counts = Counter()
+        self.window_started = time.monotonic()
+        self.replicated = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_location(cls, location, threshold, window):
+        """
+        Returns the tracker shared by every cache instance of a location (Django creates one per thread).
+        """
+        with cls._trackers_lock:
+            key = (str(location), threshold, window)
+            if key not in cls._trackers:
+                cls._trackers[key] = cls(threshold, window)
+            return cls._trackers[key]
+
+    def hit(self, key):
+        """
+        Records a read of key and returns whether the key is hot.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_started > self.window:
+                self.counts.clear()
+                self.window_started = now
+                self.replicated = {
+                    key: expires
+                    for key, expires in self.replicated.items()
+                    if expires is None or expires > now
+                }
+            self.counts[key] += 1
+            return self.counts[key] >= self.threshold
+
+    def is_hot(self, key):
+        return self.counts.get(key, 0) >= self.threshold
+
+    def add_replicated(self, key, timeout):
+        """
+        Records that key was written to its replicas for timeout seconds (None for no expiry).
+        """
+        with self.lock:
+            self.replicated[key] = (
+                None if timeout is None else time.monotonic() + timeout
+            )
+
+    def pop_replicated(self, key):
+        """
+        Forgets the replicas of key and returns whether they may still hold a value.
+        """
+        if key not in self.replicated:
+            return False
+        with self.lock:
+            expires = self.replicated.pop(key, 0)
+        return expires is None or expires > time.monotonic()
+
+
+class ShardedPyMemcacheCache(PyMemcacheCache):
+    """
+    PyMemcacheCache spread over several memcached nodes, with per-node health tracking and replication
+    of hot keys.
+
+    Besides the pymemcache HashClient options (retry_attempts, retry_timeout, dead_timeout, ignore_exc...),
+    OPTIONS accepts:
+    - replicas (int): Number of extra nodes hot keys are written to (default 0, no replication).
+    - hot_key_threshold (int): Reads within a window after which a key is hot (default 100).
+    - hot_key_window (int): Length of the window in seconds (default 60).
+
+    Replicas are written on the nodes that follow the primary in the key's rendezvous ranking. When the
+    primary node is ejected, HashClient routes the key to the next node, which already holds a copy; when
+    the primary is up but lost the key (e.g. after a restart), reads of hot keys fall back to the replicas.
+    Which keys have replicas is tracked per process: writes only clean up the replicas this process wrote.
+    Every write (set, add, set_many, touch, incr/decr, delete, delete_many) keeps the replicas up to date;
+    get_many only reads the primaries.
+
+    Django creates a backend instance per thread and per ASGI request, so the HashClient, which holds the
+    node health state, is shared by every instance of a location in the process. It uses connection
+    pooling and a LockedHashClient to be safe across threads.
+    """
+
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, server, params):
+        options = dict(params.get("OPTIONS") or {})
+        self.replicas = options.pop("replicas", 0)
+        threshold = options.pop("hot_key_threshold", 100)
+        window = options.pop("hot_key_window", 60)
+        options.setdefault("hasher", RankedRendezvousHash)
+        options.setdefault("use_pooling", True)
+        super().__init__(server, {**params, "OPTIONS": options})
+        self._class = LockedHashClient
+        self.hot_keys = HotKeyTracker.for_location(server, threshold, window)
+
+    @cached_property
+    def _cache(self):
+        """
+        Returns the HashClient shared by every instance of this location and options.
+        """
+        key = (str(self._servers), repr(sorted(self._options.items())))
+        with self._clients_lock:
+            if key not in self._clients:
+                self._clients[key] = self._class(self.client_servers, **self._options)
+            return self._clients[key]
+
+    def close(self, **kwargs):
+        # The client is shared by the whole process, dropping its connections
+        # at the end of every request would only force reconnects.
+        pass
+
+    def get(self, key, default=None, version=None):
+        if not self.replicas:
+            return super().get(key, default=default, version=version)
+        key = self.make_and_validate_key(key, version=version)
+        hot = self.hot_keys.hit(key)
+        value = self._cache.get(key, _MISSING)
+        if value is _MISSING and hot:
+            value = self._run_on_replicas(key, "get", _MISSING, _MISSING, first=True)
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout=timeout, version=version)
+        if self.replicas:
+            key = self.make_and_validate_key(key, version=version)
+            self._write_replicas(key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout=timeout, version=version)
+        if added and self.replicas:
+            key = self.make_and_validate_key(key, version=version)
+            self._write_replicas(key, value, timeout)
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed_keys = super().set_many(data, timeout=timeout, version=version)
+        if self.replicas:
+            failed = set(failed_keys)
+            for key, value in data.items():
+                if key not in failed:
+                    key = self.make_and_validate_key(key, version=version)
+                    self._write_replicas(key, value, timeout)
+        return failed_keys
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        touched = super().touch(key, timeout=timeout, version=version)
+        if touched and self.replicas:
+            key = self.make_and_validate_key(key, version=version)
+            if self.hot_keys.pop_replicated(key):
+                self._run_on_replicas(
+                    key, "touch", False, self.get_backend_timeout(timeout)
+                )
+                self.hot_keys.add_replicated(key, self._get_seconds(timeout))
+        return touched
+
+    def incr(self, key, delta=1, version=None):
+        # decr() goes through incr() with a negative delta
+        value = super().incr(key, delta=delta, version=version)
+        if self.replicas:
+            key = self.make_and_validate_key(key, version=version)
+            # the expiry isn't known here, the next set replicates the key again
+            self._drop_replicas(key)
+        return value
+
+    def delete(self, key, version=None):
+        deleted = super().delete(key, version=version)
+        if self.replicas:
+            key = self.make_and_validate_key(key, version=version)
+            self.hot_keys.pop_replicated(key)
+            self._run_on_replicas(key, "delete", False)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        super().delete_many(keys, version=version)
+        if self.replicas:
+            for key in keys:
+                key = self.make_and_validate_key(key, version=version)
+                self.hot_keys.pop_replicated(key)
+                self._run_on_replicas(key, "delete", False)
+
+    def _get_seconds(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _write_replicas(self, key, value, timeout):
+        """
+        Copies a value just written to the primary of key to its replicas when the key is hot, or drops
+        the replicas written while it was.
+        """
+        if self.hot_keys.is_hot(key):
+            self._run_on_replicas(
+                key, "set", False, value, self.get_backend_timeout(timeout)
+            )
+            self.hot_keys.add_replicated(key, self._get_seconds(timeout))
+        else:
+            self._drop_replicas(key)
+
+    def _drop_replicas(self, key):
+        # don't leave an older value behind for the replica fallback to serve
+        if self.hot_keys.pop_replicated(key):
+            self._run_on_replicas(key, "delete", False)
+
+    def _run_on_replicas(self, key, cmd, default_val, *args, first=False):
+        """
+        Runs a client command on the replica nodes of a key.
+
+        With first=True, returns the first result that isn't default_val, default_val otherwise.
+        """
+        hash_client = self._cache
+        nodes = hash_client.hasher.get_nodes(key, self.replicas + 1)[1:]
+        for node in nodes:
+            client = hash_client.clients[node]
+            # goes through HashClient so replica failures count towards the
+            # node's health like any other command
+            result = hash_client._safely_run_func(
+                client, getattr(client, cmd), default_val, key, *args
+            )
+            if first and result is not default_val:
+                return result
+        return default_val
+
+    def get_node_status(self):
+        """
+        Probes every memcached node and returns its state.
+
+        Returns:
+        A dictionary mapping each node ("host:port") to a dictionary with "ok" and "state", one of
+        "up", "failing" (in retry after errors) or "ejected" (removed until dead_timeout expires).
+        Ejected nodes are not probed.
+        """
+        hash_client = self._cache
+        failed, ejected = hash_client.get_health()
+        status = {}
+        for node, client in hash_client.clients.items():
+            if node in ejected:
+                status[node] = {"ok": False, "state": "ejected"}
+                continue
+            try:
+                version = hash_client._safely_run_func(client, client.version, None)
+            except Exception:
+                version = None
+            status[node] = {
+                "ok": version is not None,
+                "state": "failing" if node in failed or version is None else "up",
+            }
+        return status
@@ -0,0 +1,137 @@
+"""
+Module: caching.py
+Description: This module keeps the results of OpenWeatherMap lookups in the Django cache so that
+repeated requests for the same city are answered without calling the upstream API.
+
+"""
+
+import bisect
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .client import OpenWeatherMapClient
+from .timing import stage
+
+
+def make_cache_key(prefix, value):
+    """
+    Builds a memcached-safe cache key.
+
+    Parameters:
+    - prefix (str): The namespace of the key, e.g. "weather".
+    - value (str): The free-form part of the key, e.g. a city name.
+
+    Returns:
+    A string usable as a cache key regardless of spaces or non-ASCII characters in value.
+    """
+    digest = hashlib.md5(str(value).strip().lower().encode("utf-8")).hexdigest()
+    return f"core:{prefix}:{digest}"
+
+
+def get_location(city, client=None):
+    """
+    Returns the geographical information of a city, from the cache when possible.
+
+    Parameters:
+    - city (str): The name of the city.
+    - client (OpenWeatherMapClient): The client used on a cache miss (a new one is created by default).
+
+    Returns:
+    The (lat, lon, country, state) tuple of OpenWeatherMapClient.get_city_info.
+    Unknown cities are not cached.
+    """
+    key = make_cache_key("location", city)
+    with stage("cache"):
+        location = cache.get(key)
+    if location is not None:
+        return location
+
+    client = client or OpenWeatherMapClient()
+    with stage("geocode"):
+        location = client.get_city_info(city)
+    if location[0] is not None:
+        cache.set(key, location, settings.GEOCODE_CACHE_SECONDS)
+    return location
+
+
+def get_weather(city, client=None):
+    """
+    Returns the weather for a city, from the cache when possible.
+
+    Parameters:
+    - city (str): The name of the city for which weather data is requested.
+    - client (OpenWeatherMapClient): The client used on a cache miss (a new one is created by default).
+
+    Returns:
+    The dictionary returned by OpenWeatherMapClient.get_weather, extended with "expires",
+    the unix timestamp at which the cached copy stops being fresh.
+    Failed lookups are returned as is and are not cached.
+    """
+    key = make_cache_key("weather", city)
+    with stage("cache"):
+        weather_data = cache.get(key)
+    if weather_data is not None:
+        return weather_data
+
+    client = client or OpenWeatherMapClient()
+    weather_data = client.get_weather(city, location=get_location(city, client))
+    if weather_data["error"]:
+        return weather_data
+
+    timeout = settings.CACHE_SECONDS
+    weather_data["expires"] = time.time() + timeout
+    cache.set(key, weather_data, timeout)
+    return weather_data
+
+
+def get_forecast(city, client=None):
+    """
+    Returns the forecast for a city, from the cache when possible.
+
+    The forecast is cached once per location, so every city name resolving to the same place and every
+    time window requested from it share a single upstream response.
+
+    Parameters:
+    - city (str): The name of the city for which the forecast is requested.
+    - client (OpenWeatherMapClient): The client used on a cache miss (a new one is created by default).
+
+    Returns:
+    The dictionary returned by OpenWeatherMapClient.get_forecast. Failed lookups are not cached.
+    """
+    client = client or OpenWeatherMapClient()
+    location = get_location(city, client)
+    lat, lon = location[0], location[1]
+    if lat is None or lon is None:
+        return client.get_forecast(city, location=location)
+
+    key = make_cache_key("forecast", f"{lat:.4f},{lon:.4f}")
+    with stage("cache"):
+        forecast_data = cache.get(key)
+    if forecast_data is not None:
+        return forecast_data
+
+    forecast_data = client.get_forecast(city, location=location)
+    if not forecast_data["error"]:
+        cache.set(key, forecast_data, settings.FORECAST_CACHE_SECONDS)
+    return forecast_data
+
+
+def slice_forecast(entries, start=None, end=None):
+    """
+    Selects the forecast entries within a time window.
+
+    Parameters:
+    - entries (list): Parsed forecast entries ordered by "dt".
+    - start (int): Unix timestamp of the start of the window (inclusive), unbounded by default.
+    - end (int): Unix timestamp of the end of the window (exclusive), unbounded by default.
+
+    Returns:
+    The list of entries whose "dt" falls within the window.
+    """
+    timestamps = [entry["dt"] for entry in entries]
+    low = 0 if start is None else bisect.bisect_left(timestamps, start)
+    high = len(entries) if end is None else bisect.bisect_left(timestamps, end)
+    return entries[low:high]
@@ -11,6 +11,8 @@ import requests
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
+from .timing import stage
+
 
 class OpenWeatherMapClient:
     """
@@ -21,16 +23,17 @@ class OpenWeatherMapClient:
     - base_url (str): The base URL for OpenWeatherMap API requests.
 
     Methods:
-    - get_weather(city): Fetches weather data for a given city.
+    - get_weather(city, location): Fetches weather data for a given city.
+    - get_forecast(city, location): Fetches the 5 day / 3 hour forecast for a given city.
     - get_city_info(city): Retrieves geographical information for a given city.
     - get_weather_data(lat, lon): Retrieves weather data for a specific geographical location.
+    - get_forecast_data(lat, lon): Retrieves forecast data for a specific geographical location.
     - parse_weather_data(weather_data): Parses raw weather data into a structured format.
+    - parse_forecast_data(forecast_data): Parses raw forecast data into a structured format.
     - get_wind_direction(deg): Converts wind degree into a human-readable direction.
     """
 
-    def __init__(
-        self, api_key=settings.OPEN_WEATHER_API_KEY, base_url=settings.BASE_API_URL
-    ):
+    def __init__(self, api_key=None, base_url=None):
         """
         Constructor for OpenWeatherMapClient class.
 
@@ -38,20 +41,22 @@ class OpenWeatherMapClient:
         - api_key (str): The API key used for authentication (default is the key from Django settings).
         - base_url (str): The base URL for API requests (default is the base URL from Django settings).
         """
-        self.api_key = api_key
-        self.base_url = base_url
+        self.api_key = api_key or settings.OPEN_WEATHER_API_KEY
+        self.base_url = base_url or settings.BASE_API_URL
 
-    def get_weather(self, city):
+    def get_weather(self, city, location=None):
         """
         Fetches weather data for a given city.
 
         Parameters:
         - city (str): The name of the city for which weather data is requested.
+        - location (tuple): The result of get_city_info for the city, looked up when not given.
 
         Returns:
         A dictionary containing weather information or an error message if the data retrieval fails.
+        On success it also carries "dt", the upstream observation time as a unix timestamp.
         """
-        lat, lon, country, state = self.get_city_info(city)
+        lat, lon, country, state = location or self.get_city_info(city)
 
         if not lat or not lon:
             logging.error(f"City not found for {city}")
@@ -61,7 +66,8 @@ class OpenWeatherMapClient:
                 "data": None,
             }
 
-        weather_data = self.get_weather_data(lat, lon)
+        with stage("weather_fetch"):
+            weather_data = self.get_weather_data(lat, lon)
 
         if not weather_data:
             logging.error(f"Failed to fetch weather data for {city}")
@@ -71,12 +77,55 @@ class OpenWeatherMapClient:
                 "data": None,
             }
 
-        parsed_weather_data = self.parse_weather_data(weather_data)
+        with stage("parse"):
+            parsed_weather_data = self.parse_weather_data(weather_data)
         logging.info(f"Weather data fetched successfully for {city}")
         return {
             "error": False,
             "message": _("weather data fetched successfully."),
             "data": parsed_weather_data,
+            "dt": weather_data.get("dt"),
+        }
+
+    def get_forecast(self, city, location=None):
+        """
+        Fetches the 5 day / 3 hour forecast for a given city.
+
+        Parameters:
+        - city (str): The name of the city for which the forecast is requested.
+        - location (tuple): The result of get_city_info for the city, looked up when not given.
+
+        Returns:
+        A dictionary containing the parsed forecast or an error message if the data retrieval fails.
+        """
+        lat, lon, country, state = location or self.get_city_info(city)
+
+        if not lat or not lon:
+            logging.error(f"City not found for {city}")
+            return {
+                "error": True,
+                "message": _("City not found"),
+                "data": None,
+            }
+
+        with stage("forecast_fetch"):
+            forecast_data = self.get_forecast_data(lat, lon)
+
+        if not forecast_data:
+            logging.error(f"Failed to fetch forecast data for {city}")
+            return {
+                "error": True,
+                "message": _("Failed to fetch forecast data."),
+                "data": None,
+            }
+
+        with stage("parse"):
+            parsed_forecast_data = self.parse_forecast_data(forecast_data)
+        logging.info(f"Forecast data fetched successfully for {city}")
+        return {
+            "error": False,
+            "message": _("forecast data fetched successfully."),
+            "data": parsed_forecast_data,
         }
 
     def get_city_info(self, city):
@@ -124,6 +173,25 @@ class OpenWeatherMapClient:
 
         return weather_data
 
+    def get_forecast_data(self, lat, lon):
+        """
+        Retrieves the 5 day / 3 hour forecast for a specific geographical location.
+
+        Parameters:
+        - lat (float): Latitude of the location.
+        - lon (float): Longitude of the location.
+
+        Returns:
+        Raw forecast data from the OpenWeatherMap API.
+        """
+        url = f"{self.base_url}data/2.5/forecast?lat={lat}&lon={lon}&units=metric&appid={self.api_key}"
+        response = requests.get(url)
+
+        if response.status_code != 200:
+            return None
+
+        return response.json()
+
     def parse_weather_data(self, weather_data):
         """
         Parses raw weather data obtained from the OpenWeatherMap API into a structured format.
@@ -172,6 +240,35 @@ class OpenWeatherMapClient:
 
         return parsed_data
 
+    def parse_forecast_data(self, forecast_data):
+        """
+        Parses raw forecast data obtained from the OpenWeatherMap API into a structured format.
+
+        Parameters:
+        - forecast_data (dict): Raw forecast data as a dictionary.
+
+        Returns:
+        A dictionary with the following keys:
+        - "city" (str): The name of the city.
+        - "timezone" (int): The shift in seconds from UTC of the city's local time.
+        - "entries" (list): One dictionary per forecast step, ordered by time, holding "dt" (the unix
+          timestamp of the step) and the same keys as parse_weather_data except "city".
+        """
+        city = forecast_data.get("city", {})
+        entries = []
+        for entry in forecast_data.get("list", []):
+            parsed_entry = self.parse_weather_data(entry)
+            del parsed_entry["city"]
+            parsed_entry["dt"] = entry.get("dt")
+            entries.append(parsed_entry)
+        entries.sort(key=lambda parsed_entry: parsed_entry["dt"])
+
+        return {
+            "city": city.get("name"),
+            "timezone": city.get("timezone", 0),
+            "entries": entries,
+        }
+
     def get_wind_direction(self, deg):
         """
         Converts wind degree into a human-readable direction.
@@ -0,0 +1,173 @@
+"""
+Module: events.py
+Description: This module pushes weather updates to Server-Sent Events subscribers. A single refresher task
+per city fetches the weather and fans every change out to all clients subscribed to that city, so the number
+of upstream requests no longer grows with the number of connected clients.
+
+"""
+
+import asyncio
+import json
+import logging
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .caching import get_weather
+from .serializers import WeatherSerializer
+
+
+def format_event(event, data, event_id=None):
+    """
+    Encodes a message in the Server-Sent Events wire format.
+
+    Parameters:
+    - event (str): The event name, e.g. "weather".
+    - data (dict): The payload, sent as JSON.
+    - event_id (str): Optional event id, sent back by browsers as Last-Event-ID on reconnect.
+
+    Returns:
+    The encoded message as bytes.
+    """
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    message += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return message.encode("utf-8")
+
+
+class CityRefresher:
+    """
+    CityRefresher periodically fetches the weather for one city and publishes it to the subscribers' queues.
+
+    Attributes:
+    - city (str): The city being refreshed.
+    - subscribers (set): The asyncio queues of the connected clients.
+    - last_event (bytes): The last message published, replayed to new subscribers.
+
+    Methods:
+    - refresh(): Fetches the weather once and publishes it if it changed.
+    - run(): Refreshes every WEATHER_STREAM_INTERVAL seconds for as long as there are subscribers.
+    """
+
+    def __init__(self, city, interval):
+        self.city = city
+        self.interval = interval
+        self.subscribers = set()
+        self.last_event = None
+        self._last_value = None
+        self.task = None
+
+    async def refresh(self):
+        """
+        Fetches the weather once and publishes it to every subscriber when it differs from the previous value.
+
+        Returns:
+        True if a message was published, False otherwise.
+        """
+        try:
+            weather_data = await sync_to_async(get_weather, thread_sensitive=False)(
+                self.city
+            )
+        except Exception:
+            logging.exception(f"Failed to refresh weather data for {self.city}")
+            return False
+
+        if weather_data["error"]:
+            value = {"city": self.city, "message": str(weather_data["message"])}
+            event, event_id = "error", None
+        else:
+            value = dict(WeatherSerializer(weather_data["data"]).data)
+            event, event_id = "weather", weather_data.get("dt")
+
+        if value == self._last_value:
+            return False
+
+        self._last_value = value
+        self.last_event = format_event(event, value, event_id)
+        for queue in self.subscribers:
+            self.publish(queue, self.last_event)
+        return True
+
+    @staticmethod
+    def publish(queue, message):
+        """
+        Puts a message on a subscriber queue, dropping the oldest one if a slow client let the queue fill up.
+        """
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    async def run(self):
+        """
+        Refreshes the city until the last subscriber leaves.
+        """
+        while self.subscribers:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+
+class WeatherBroadcaster:
+    """
+    WeatherBroadcaster keeps one CityRefresher per subscribed city and routes subscribers to them.
+
+    Methods:
+    - subscribe(cities): Registers a new client and returns the queue its messages are delivered to.
+    - unsubscribe(queue, cities): Removes a client, stopping refreshers nobody listens to anymore.
+    """
+
+    def __init__(self, interval=None, queue_size=None):
+        self.interval = interval or settings.WEATHER_STREAM_INTERVAL
+        self.queue_size = queue_size or settings.WEATHER_STREAM_QUEUE_SIZE
+        self.refreshers = {}
+
+    def subscribe(self, cities):
+        """
+        Subscribes a client to a set of cities.
+
+        Parameters:
+        - cities (iterable): The normalized city names.
+
+        Returns:
+        An asyncio.Queue receiving the encoded messages, primed with the latest known value of each city.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        for city in cities:
+            refresher = self.refreshers.get(city)
+            if refresher is None:
+                refresher = self.refreshers[city] = CityRefresher(city, self.interval)
+            refresher.subscribers.add(queue)
+            if refresher.last_event is not None:
+                refresher.publish(queue, refresher.last_event)
+            if refresher.task is None or refresher.task.done():
+                refresher.task = asyncio.create_task(refresher.run())
+        return queue
+
+    def unsubscribe(self, queue, cities):
+        """
+        Unsubscribes a client from the given cities.
+        """
+        for city in cities:
+            refresher = self.refreshers.get(city)
+            if refresher is None:
+                continue
+            refresher.subscribers.discard(queue)
+            if not refresher.subscribers:
+                if refresher.task is not None:
+                    refresher.task.cancel()
+                del self.refreshers[city]
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster():
+    """
+    Returns the WeatherBroadcaster bound to the running event loop, creating it on first use.
+    """
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = _broadcasters[loop] = WeatherBroadcaster()
+    return broadcaster
@@ -0,0 +1,88 @@
+import os
+import resource
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Boots the project the way a worker does: app registry, then the URLconf,
+# which pulls in every view module.
+BOOT_SCRIPT = (
+    "import django; django.setup(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+
+
+class Command(BaseCommand):
+    """Django command to report where start-up import time goes"""
+
+    help = (
+        "Boots the project in a fresh interpreter with -X importtime and reports the "
+        "slowest packages and modules, the total import time and the peak memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=15,
+            help="Number of packages and modules to list (default 15).",
+        )
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        env.setdefault("DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", BOOT_SCRIPT],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Project start-up failed:\n{result.stderr}")
+
+        modules = self.parse_importtime(result.stderr)
+        packages = defaultdict(int)
+        for module, (self_us, cumulative_us) in modules.items():
+            packages[module.split(".")[0]] += self_us
+        total_us = sum(packages.values())
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+        limit = options["limit"]
+        self.stdout.write(f"Settings profile: {settings.SETTINGS_PROFILE}")
+        self.stdout.write(f"Optional apps: {', '.join(settings.OPTIONAL_APPS) or '-'}")
+        self.stdout.write(
+            f"Imported {len(modules)} modules in {total_us / 1000:.1f} ms, "
+            f"peak RSS {peak_rss_mb:.1f} MB"
+        )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Slowest packages (self time)"))
+        for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[
+            :limit
+        ]:
+            self.stdout.write(f"{self_us / 1000:10.1f} ms  {package}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Slowest modules (cumulative)"))
+        for module, (self_us, cumulative_us) in sorted(
+            modules.items(), key=lambda item: -item[1][1]
+        )[:limit]:
+            self.stdout.write(f"{cumulative_us / 1000:10.1f} ms  {module}")
+
+    @staticmethod
+    def parse_importtime(output):
+        """
+        Parses the output of python -X importtime.
+
+        Returns:
+        A dictionary mapping each module name to its (self, cumulative) import time in microseconds.
+        """
+        modules = {}
+        for line in output.splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:") :].split("|")
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+        return modules
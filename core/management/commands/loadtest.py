@@ -0,0 +1,458 @@
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from wsgiref.util import setup_testing_defaults
+
+import requests
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from core.timing import parse_server_timing
+
+CITIES = [
+    "London", "Paris", "New York", "Tokyo", "Berlin", "Madrid", "Rome", "Cairo",
+    "Dubai", "Mumbai", "Delhi", "Beijing", "Shanghai", "Singapore", "Sydney",
+    "Toronto", "Chicago", "Los Angeles", "Mexico City", "Sao Paulo",
+    "Buenos Aires", "Lagos", "Nairobi", "Istanbul", "Moscow", "Seoul", "Bangkok",
+    "Jakarta", "Manila", "Karachi", "Lima", "Bogota", "Santiago", "Lisbon",
+    "Vienna", "Prague", "Warsaw", "Stockholm", "Oslo", "Helsinki",
+]  # fmt: skip
+
+STAGES = ["cache", "geocode", "weather_fetch", "parse", "serialize"]
+
+# samples kept per measurement, so the memory of long runs stays flat
+RESERVOIR_SIZE = 10000
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """
+    Answers the OpenWeatherMap endpoints used by the client with deterministic data for any city.
+    """
+
+    latency = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        time.sleep(self.latency)
+
+        if url.path == "/geo/1.0/direct":
+            seed = int(hashlib.md5(query["q"].lower().encode()).hexdigest()[:8], 16)
+            body = [
+                {
+                    "name": query["q"],
+                    "lat": round(seed % 18000 / 100 - 90, 4),
+                    "lon": round(seed // 18000 % 36000 / 100 - 180, 4),
+                    "country": "XX",
+                }
+            ]
+        elif url.path == "/data/2.5/weather":
+            body = self.weather(query)
+        elif url.path == "/data/2.5/forecast":
+            body = {
+                "city": {"name": "Fake", "timezone": 0},
+                "list": [
+                    {
+                        **self.weather(query),
+                        "dt": self.weather(query)["dt"] + step * 10800,
+                    }
+                    for step in range(40)
+                ],
+            }
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    @staticmethod
+    def weather(query):
+        # observations change every 10 minutes, like the real API
+        dt = int(time.time()) // 600 * 600
+        temp = round(float(query["lat"]) / 5 + dt % 7, 1)
+        return {
+            "dt": dt,
+            "name": "Fake",
+            "main": {
+                "temp": temp,
+                "temp_min": temp - 1,
+                "temp_max": temp + 1,
+                "humidity": 60,
+                "pressure": 1012,
+            },
+            "wind": {"speed": 3.5, "deg": dt % 360},
+            "weather": [{"description": "scattered clouds"}],
+        }
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(
+        len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1)))
+    )
+    return sorted_values[index]
+
+
+class Reservoir:
+    """
+    Keeps the count, sum and maximum of a stream of values and a uniform sample of at most size of them
+    (reservoir sampling) to compute percentiles from.
+    """
+
+    def __init__(self, size=RESERVOIR_SIZE, seed=0):
+        self.size = size
+        self.samples = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rng = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            index = self.rng.randrange(self.count)
+            if index < self.size:
+                self.samples[index] = value
+
+    def percentile(self, pct):
+        return percentile(sorted(self.samples), pct)
+
+
+def wsgi_get(handler, path):
+    """
+    Sends a GET request straight to a WSGI handler and returns the (status code, headers) of the response.
+
+    Unlike the test client, this keeps nothing around per request, so it doesn't add to the memory growth
+    of in-process runs.
+    """
+    environ = {"REQUEST_METHOD": "GET", "PATH_INFO": unquote(path)}
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split()[0])
+        response["headers"] = dict(headers)
+
+    body = handler(environ, start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        body.close()
+    return response["status"], response["headers"]
+
+
+def read_rss_mb(pid="self"):
+    """
+    Returns the resident memory of a process in MB, read from /proc on Linux.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == "self":
+        # ru_maxrss is the peak, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+
+def read_process_children():
+    """
+    Returns a dictionary mapping each PID to the PIDs of its child processes, read from /proc on Linux.
+    """
+    children = defaultdict(list)
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return children
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # the command name may contain spaces, the fields after it don't
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry))
+    return children
+
+
+def read_tree_rss_mb(pids):
+    """
+    Returns the resident memory in MB of the given processes and all their descendants, e.g. a gunicorn
+    master and its workers.
+    """
+    children = read_process_children()
+    seen = set()
+    pending = list(pids)
+    total = None
+    while pending:
+        pid = pending.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            total = (total or 0) + rss
+        pending.extend(children.get(pid, []))
+    return total
+
+
+class Command(BaseCommand):
+    """Django command to load test the weather endpoint with skewed city traffic"""
+
+    help = (
+        "Sends Zipf-distributed city requests to the weather endpoint, either in-process or to "
+        "--url, and reports throughput, latency percentiles, per-stage timings (from the "
+        "Server-Timing header) and memory growth."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            help="Base URL of a running instance, e.g. http://localhost:8000. "
+            "Requests go through the in-process test client when omitted.",
+        )
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument(
+            "--duration", type=float, default=30, help="Seconds to run (default 30)."
+        )
+        parser.add_argument(
+            "--cities",
+            type=int,
+            default=len(CITIES),
+            help="Number of distinct cities; names beyond the built-in list are "
+            "synthetic and only resolve with --fake-upstream.",
+        )
+        parser.add_argument(
+            "--zipf",
+            type=float,
+            default=1.1,
+            help="Skew of the city popularity, 0 for uniform (default 1.1).",
+        )
+        parser.add_argument(
+            "--fake-upstream",
+            action="store_true",
+            help="Serve the OpenWeatherMap API from a local fake. In-process runs use it "
+            "directly; for --url runs, start the instance with the printed BASE_API_URL.",
+        )
+        parser.add_argument("--fake-upstream-port", type=int, default=0)
+        parser.add_argument(
+            "--upstream-latency",
+            type=float,
+            default=50,
+            help="Latency of the fake upstream in milliseconds (default 50).",
+        )
+        parser.add_argument(
+            "--local-cache",
+            action="store_true",
+            help="Use a local-memory cache instead of CACHES for in-process runs.",
+        )
+        parser.add_argument(
+            "--pid",
+            type=int,
+            nargs="+",
+            help="PIDs of the server processes to sample memory from, their child processes "
+            "(e.g. gunicorn workers) included (default: this process).",
+        )
+        parser.add_argument(
+            "--sample-interval",
+            type=float,
+            default=5,
+            help="Seconds between memory samples (default 5).",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1 or options["duration"] <= 0:
+            raise CommandError("--concurrency and --duration must be positive")
+        if options["cities"] < 1:
+            raise CommandError("--cities must be at least 1")
+
+        cities = (
+            CITIES + [f"city-{i}" for i in range(len(CITIES), options["cities"])]
+        )[: options["cities"]]
+        weights = [1 / rank ** options["zipf"] for rank in range(1, len(cities) + 1)]
+        cum_weights = list(itertools.accumulate(weights))
+
+        overrides = {}
+        upstream = None
+        if options["fake_upstream"]:
+            FakeUpstreamHandler.latency = options["upstream_latency"] / 1000
+            upstream = ThreadingHTTPServer(
+                ("127.0.0.1", options["fake_upstream_port"]), FakeUpstreamHandler
+            )
+            threading.Thread(target=upstream.serve_forever, daemon=True).start()
+            base_api_url = f"http://127.0.0.1:{upstream.server_port}/"
+            self.stdout.write(f"Fake upstream: BASE_API_URL={base_api_url}")
+            overrides["BASE_API_URL"] = base_api_url
+        if not options["url"]:
+            # measure the app as production runs it: with DEBUG on, the debug
+            # toolbar instruments every request and keeps its results around
+            overrides["DEBUG"] = False
+            overrides["SERVER_TIMING"] = True
+            if options["local_cache"]:
+                overrides["CACHES"] = {
+                    "default": {
+                        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                        "TIMEOUT": settings.CACHE_SECONDS,
+                    }
+                }
+
+        if options["verbosity"] < 2:
+            # the per-request info logs would drown the report
+            logging.disable(logging.INFO)
+        try:
+            with override_settings(**overrides):
+                results = self.run(options, cities, cum_weights)
+        finally:
+            logging.disable(logging.NOTSET)
+            if upstream is not None:
+                upstream.shutdown()
+                upstream.server_close()
+
+        self.report(results, options)
+
+    def run(self, options, cities, cum_weights):
+        results = {
+            "latencies": Reservoir(seed=options["seed"]),
+            "statuses": Counter(),
+            "stages": defaultdict(lambda: Reservoir(seed=options["seed"])),
+            "memory": [],
+        }
+        lock = threading.Lock()
+        started = time.monotonic()
+        deadline = started + options["duration"]
+        if options["pid"]:
+            read_memory = functools.partial(read_tree_rss_mb, options["pid"])
+        else:
+            read_memory = read_rss_mb
+
+        # built here so that it picks up the overridden settings
+        handler = None if options["url"] else WSGIHandler()
+
+        def worker(number):
+            rng = random.Random(options["seed"] + number)
+            if options["url"]:
+                session = requests.Session()
+                base_url = options["url"].rstrip("/")
+
+            while time.monotonic() < deadline:
+                city = rng.choices(cities, cum_weights=cum_weights)[0]
+                path = reverse("core:weather-api", kwargs={"city": city})
+                request_started = time.perf_counter()
+                try:
+                    if options["url"]:
+                        response = session.get(base_url + path, timeout=30)
+                        status_code, headers = response.status_code, response.headers
+                    else:
+                        status_code, headers = wsgi_get(handler, path)
+                except requests.RequestException as error:
+                    status_code, headers = error.__class__.__name__, {}
+                latency = time.perf_counter() - request_started
+
+                stages = {}
+                if headers.get("Server-Timing"):
+                    stages = parse_server_timing(headers["Server-Timing"])
+                with lock:
+                    results["latencies"].add(latency * 1000)
+                    results["statuses"][status_code] += 1
+                    for name, duration in stages.items():
+                        results["stages"][name].add(duration)
+
+        threads = [
+            threading.Thread(target=worker, args=(number,), daemon=True)
+            for number in range(options["concurrency"])
+        ]
+        for thread in threads:
+            thread.start()
+
+        while any(thread.is_alive() for thread in threads):
+            results["memory"].append((time.monotonic() - started, read_memory()))
+            next_sample = time.monotonic() + options["sample_interval"]
+            for thread in threads:
+                thread.join(timeout=max(0, next_sample - time.monotonic()))
+        results["memory"].append((time.monotonic() - started, read_memory()))
+        results["elapsed"] = time.monotonic() - started
+        return results
+
+    def report(self, results, options):
+        latencies = results["latencies"]
+        total = latencies.count
+        self.stdout.write(self.style.MIGRATE_HEADING("Requests"))
+        self.stdout.write(
+            f"{total} requests in {results['elapsed']:.1f} s, "
+            f"{total / results['elapsed']:.1f} req/s, concurrency {options['concurrency']}"
+        )
+        statuses = ", ".join(
+            f"{status}: {count}" for status, count in results["statuses"].most_common()
+        )
+        self.stdout.write(f"Responses: {statuses or '-'}")
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Latency (ms)"))
+        self.stdout.write(
+            "  ".join(
+                f"p{pct}={latencies.percentile(pct):.1f}" for pct in (50, 90, 95, 99)
+            )
+            + f"  max={latencies.max:.1f}"
+        )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Stages (ms, per request)"))
+        if not results["stages"]:
+            self.stdout.write(
+                "No Server-Timing headers received, set SERVER_TIMING=True on the server."
+            )
+        names = STAGES + sorted(set(results["stages"]) - set(STAGES))
+        for name in names:
+            durations = results["stages"].get(name)
+            if durations is None:
+                continue
+            self.stdout.write(
+                f"{name:>14}  mean={durations.total / total:7.2f}  "
+                f"p50={durations.percentile(50):7.2f}  "
+                f"p95={durations.percentile(95):7.2f}  "
+                f"seen in {durations.count / total:.0%} of requests"
+            )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Memory (RSS MB)"))
+        if options["pid"]:
+            self.stdout.write(
+                f"PIDs {', '.join(map(str, options['pid']))} and their child processes"
+            )
+        samples = [(elapsed, rss) for elapsed, rss in results["memory"] if rss]
+        if not samples:
+            self.stdout.write("Not available")
+            return
+        for elapsed, rss in samples:
+            self.stdout.write(f"{elapsed:7.1f} s  {rss:8.1f}")
+        self.stdout.write(f"Growth: {samples[-1][1] - samples[0][1]:+.1f} MB")
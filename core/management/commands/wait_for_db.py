@@ -1,6 +1,6 @@
 import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import connections
 from django.db.utils import OperationalError
 
@@ -8,13 +8,25 @@ from django.db.utils import OperationalError
 class Command(BaseCommand):
     """Django command to pause execution until DB is ready"""
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=60,
+            help="Seconds to wait before giving up (default 60).",
+        )
+
     def handle(self, *args, **options):
         self.stdout.write("Waiting for database")
-        db_conn = None
-        while not db_conn:
+        deadline = time.monotonic() + options["timeout"]
+        db_conn = connections["default"]
+        while True:
             try:
-                db_conn = connections["default"]
+                db_conn.ensure_connection()
+                break
             except OperationalError:
+                if time.monotonic() >= deadline:
+                    raise CommandError("Database not available, giving up")
                 self.stdout.write("Database not available, waiting 1 second")
                 time.sleep(1)
 
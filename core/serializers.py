@@ -1,3 +1,5 @@
+from datetime import datetime, timezone
+
 from rest_framework import serializers
 
 
@@ -11,3 +13,30 @@ class WeatherSerializer(serializers.Serializer):
     windSpeed = serializers.CharField(max_length=100)
     wind_direction = serializers.CharField(max_length=100)
     description = serializers.CharField(max_length=255)
+
+
+class ForecastEntrySerializer(serializers.Serializer):
+    """
+    Serializes one forecast step. The optional ``fields`` argument restricts the output to the
+    given field names, "dt" and "time" are always included.
+    """
+
+    dt = serializers.IntegerField()
+    time = serializers.SerializerMethodField()
+    temperature = serializers.CharField(max_length=100)
+    min_temperature = serializers.CharField(max_length=100)
+    max_temperature = serializers.CharField(max_length=100)
+    humidity = serializers.CharField(max_length=100)
+    pressure = serializers.CharField(max_length=100)
+    windSpeed = serializers.CharField(max_length=100)
+    wind_direction = serializers.CharField(max_length=100)
+    description = serializers.CharField(max_length=255)
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for field_name in set(self.fields) - set(fields) - {"dt", "time"}:
+                self.fields.pop(field_name)
+
+    def get_time(self, entry):
+        return datetime.fromtimestamp(entry["dt"], tz=timezone.utc).isoformat()
@@ -1,13 +1,27 @@
+import asyncio
+import io
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 
 from django.conf import settings
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db.utils import OperationalError
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from pymemcache.serde import pickle_serde
+from pymemcache.test.utils import MockMemcacheClient
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from .cache_backends import RankedRendezvousHash, ShardedPyMemcacheCache
 from .client import OpenWeatherMapClient
+from .events import CityRefresher, WeatherBroadcaster
+from .management.commands.import_report import Command as ImportReportCommand
+from .management.commands.loadtest import Reservoir
+from .timing import format_server_timing, parse_server_timing
+from .views import WeatherAPIView
 
 
 class TestOpenWeatherMapClient(unittest.TestCase):
@@ -64,6 +78,36 @@ class TestOpenWeatherMapClient(unittest.TestCase):
 
         self.assertIsNone(result)
 
+    def test_parse_forecast_data(self):
+        weather_client = OpenWeatherMapClient(api_key=self.api_key)
+
+        result = weather_client.parse_forecast_data(FORECAST_DATA)
+
+        self.assertEqual(result["city"], "London")
+        self.assertEqual(result["timezone"], 0)
+        self.assertEqual([entry["dt"] for entry in result["entries"]], [1000, 11800])
+        self.assertEqual(result["entries"][0]["temperature"], "10 °C")
+        self.assertNotIn("city", result["entries"][0])
+
+
+FORECAST_DATA = {
+    "city": {"name": "London", "timezone": 0},
+    "list": [
+        {
+            "dt": 11800,
+            "main": {"temp": 13},
+            "wind": {"speed": 2, "deg": 90},
+            "weather": [{"description": "clear sky"}],
+        },
+        {
+            "dt": 1000,
+            "main": {"temp": 10},
+            "wind": {"speed": 3, "deg": 270},
+            "weather": [{"description": "light rain"}],
+        },
+    ],
+}
+
 
 def get_city_url(city):
     return reverse("core:weather-api", kwargs={"city": city})
@@ -90,3 +134,497 @@ class WeatherAPITest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIn("error", response.data)
         self.assertIn("message", response.data)
+
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+WEATHER_RESULT = {
+    "error": False,
+    "message": "weather data fetched successfully.",
+    "data": {
+        "city": "London",
+        "temperature": "12.5 °C",
+        "min_temperature": "11.0 °C",
+        "max_temperature": "14.0 °C",
+        "humidity": "80%",
+        "pressure": "1012 hPa",
+        "windSpeed": "4.1 m/s",
+        "wind_direction": "West",
+        "description": "light rain",
+    },
+    "dt": 1707393600,
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WeatherConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        patcher = patch(
+            "core.caching.OpenWeatherMapClient.get_weather",
+            side_effect=lambda city, location=None: dict(WEATHER_RESULT),
+        )
+        self.mock_get_weather = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch(
+            "core.caching.OpenWeatherMapClient.get_city_info",
+            return_value=(51.509865, -0.118092, "GB", "England"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def test_response_has_validators(self):
+        response = self.client.get(get_city_url("London"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["ETag"], '"1707393600"')
+        self.assertEqual(response["Last-Modified"], "Thu, 08 Feb 2024 12:00:00 GMT")
+        self.assertIn("max-age=", response["Cache-Control"])
+
+    def test_if_none_match_returns_not_modified(self):
+        self.client.get(get_city_url("London"))
+        with patch.object(WeatherAPIView, "get_serializer") as mock_serializer:
+            response = self.client.get(
+                get_city_url("London"), HTTP_IF_NONE_MATCH='"1707393600"'
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], '"1707393600"')
+        mock_serializer.assert_not_called()
+        self.assertEqual(self.mock_get_weather.call_count, 1)
+
+    @override_settings(SERVER_TIMING=True)
+    def test_server_timing(self):
+        response = self.client.get(get_city_url("London"))
+        stages = parse_server_timing(response["Server-Timing"])
+        self.assertIn("cache", stages)
+        self.assertIn("serialize", stages)
+
+    def test_stale_etag_returns_body(self):
+        response = self.client.get(
+            get_city_url("London"), HTTP_IF_NONE_MATCH='"1707390000"'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["city"], "London")
+
+
+class TestWeatherBroadcaster(unittest.IsolatedAsyncioTestCase):
+    @patch("core.events.get_weather", side_effect=lambda city: dict(WEATHER_RESULT))
+    async def test_refresh_publishes_only_changes(self, mock_get_weather):
+        refresher = CityRefresher("london", interval=60)
+        queue = asyncio.Queue()
+        refresher.subscribers.add(queue)
+
+        self.assertTrue(await refresher.refresh())
+        self.assertFalse(await refresher.refresh())
+
+        self.assertEqual(queue.qsize(), 1)
+        message = queue.get_nowait().decode()
+        self.assertTrue(message.startswith("event: weather\nid: 1707393600\n"))
+        self.assertIn('"city": "London"', message)
+
+    @patch("core.events.get_weather", side_effect=lambda city: dict(WEATHER_RESULT))
+    async def test_subscribers_share_one_refresher(self, mock_get_weather):
+        broadcaster = WeatherBroadcaster(interval=60, queue_size=10)
+        first = broadcaster.subscribe(["london"])
+        second = broadcaster.subscribe(["london"])
+
+        self.assertEqual(len(broadcaster.refreshers), 1)
+        await asyncio.wait_for(first.get(), 1)
+        await asyncio.wait_for(second.get(), 1)
+        self.assertEqual(mock_get_weather.call_count, 1)
+
+        broadcaster.unsubscribe(first, ["london"])
+        broadcaster.unsubscribe(second, ["london"])
+        self.assertEqual(broadcaster.refreshers, {})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WeatherStreamTest(TestCase):
+    @patch("core.events.get_weather", side_effect=lambda city: dict(WEATHER_RESULT))
+    async def test_stream_sends_weather_events(self, mock_get_weather):
+        response = await self.async_client.get(
+            reverse("core:weather-stream"), {"cities": "London"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b"retry: "))
+        event = (await asyncio.wait_for(anext(chunks), 5)).decode()
+        await chunks.aclose()
+
+        self.assertTrue(event.startswith("event: weather\nid: 1707393600\n"))
+        self.assertIn('"city": "London"', event)
+
+    def test_stream_requires_asgi(self):
+        response = self.client.get(reverse("core:weather-stream"), {"cities": "London"})
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+    def test_stream_requires_cities(self):
+        response = self.client.get(reverse("core:weather-stream"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.json()["error"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ForecastAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.now = int(time.time())
+        forecast_data = {
+            "city": {"name": "London", "timezone": 0},
+            "list": [
+                {
+                    "dt": self.now + hours * 3600,
+                    "main": {"temp": hours},
+                    "wind": {"speed": 2, "deg": 90},
+                    "weather": [{"description": "clear sky"}],
+                }
+                # the first step started an hour ago and is still in progress
+                for hours in range(-1, 47, 3)
+            ],
+        }
+        patcher = patch(
+            "core.caching.OpenWeatherMapClient.get_forecast_data",
+            return_value=forecast_data,
+        )
+        self.mock_get_forecast_data = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch(
+            "core.caching.OpenWeatherMapClient.get_city_info",
+            return_value=(51.509865, -0.118092, "GB", "England"),
+        )
+        self.mock_get_city_info = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def get_forecast(self, city="London", **params):
+        return self.client.get(
+            reverse("core:forecast-api", kwargs={"city": city}), params
+        )
+
+    def test_windows_share_one_upstream_response(self):
+        response = self.get_forecast(hours=6)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [entry["dt"] for entry in response.data["forecast"]],
+            [self.now - 3600, self.now + 2 * 3600, self.now + 5 * 3600],
+        )
+
+        response = self.get_forecast(city="london", date="tomorrow")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.mock_get_forecast_data.call_count, 1)
+        self.assertEqual(self.mock_get_city_info.call_count, 1)
+
+    def test_fields(self):
+        response = self.get_forecast(fields="temperature")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["forecast"]), 16)
+        self.assertEqual(
+            set(response.data["forecast"][0]), {"dt", "time", "temperature"}
+        )
+
+    def test_invalid_parameters(self):
+        for params in ({"hours": "0"}, {"date": "someday"}, {"fields": "snow"}):
+            response = self.get_forecast(**params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertTrue(response.data["error"])
+
+
+class ImportReportTest(unittest.TestCase):
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   _io\n"
+            "import time:      1500 |       4200 | django.urls\n"
+        )
+
+        modules = ImportReportCommand.parse_importtime(output)
+
+        self.assertEqual(modules, {"_io": (120, 120), "django.urls": (1500, 4200)})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HealthViewTest(TestCase):
+    def test_healthy(self):
+        response = self.client.get(reverse("core:health"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.json()["checks"]["database"]["ok"])
+        self.assertTrue(response.json()["checks"]["cache"]["ok"])
+
+    @patch("django.core.cache.cache.get", side_effect=ConnectionRefusedError)
+    def test_cache_unavailable(self, mock_cache_get):
+        response = self.client.get(reverse("core:health"))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(
+            response.json()["checks"]["cache"]["error"], "ConnectionRefusedError"
+        )
+
+
+class WaitForDbTest(unittest.TestCase):
+    @patch("core.management.commands.wait_for_db.time.sleep")
+    @patch("django.db.backends.base.base.BaseDatabaseWrapper.ensure_connection")
+    def test_waits_until_database_is_reachable(self, mock_ensure, mock_sleep):
+        mock_ensure.side_effect = [OperationalError, OperationalError, None]
+
+        call_command("wait_for_db", stdout=io.StringIO())
+
+        self.assertEqual(mock_ensure.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+
+class FailingMemcacheClient(MockMemcacheClient):
+    def get(self, key, default=None):
+        raise ConnectionRefusedError
+
+
+class FlakyMemcacheClient(MockMemcacheClient):
+    down = set()
+
+    def __init__(self, server, **kwargs):
+        # like connecting, takes a while, so threads overlap when reviving a node
+        time.sleep(0.001)
+        super().__init__(server=server, serde=pickle_serde)
+
+    def get(self, key, default=None):
+        if self.server in self.down:
+            raise ConnectionRefusedError
+        return super().get(key, default)
+
+
+class ShardedCacheTest(unittest.TestCase):
+    nodes = ["cache1:11211", "cache2:11211", "cache3:11211"]
+    options = {
+        "replicas": 1,
+        "hot_key_threshold": 2,
+        "hot_key_window": 60,
+        "retry_attempts": 0,
+        "ignore_exc": True,
+    }
+
+    def setUp(self):
+        ShardedPyMemcacheCache._clients.clear()
+        self.addCleanup(ShardedPyMemcacheCache._clients.clear)
+        self.cache = ShardedPyMemcacheCache(self.nodes, {"OPTIONS": self.options})
+        self.cache.hot_keys.counts.clear()
+        self.cache.hot_keys.replicated.clear()
+        self.cache._cache.clients = {
+            node: MockMemcacheClient(server=node, serde=pickle_serde)
+            for node in self.nodes
+        }
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        hasher = RankedRendezvousHash()
+        for node in self.nodes:
+            hasher.add_node(node)
+        keys = [f"key-{i}" for i in range(300)]
+        before = {key: hasher.get_node(key) for key in keys}
+
+        hasher.remove_node("cache2:11211")
+
+        for key in keys:
+            if before[key] != "cache2:11211":
+                self.assertEqual(hasher.get_node(key), before[key])
+        self.assertEqual(hasher.get_nodes("key-1", 2)[0], hasher.get_node("key-1"))
+
+    def test_hot_keys_survive_primary_loss(self):
+        self.cache.set("london", {"temperature": 10})
+        self.cache.get("london")
+        self.cache.get("london")
+        self.cache.set("london", {"temperature": 12})
+
+        key = self.cache.make_key("london")
+        primary, replica = self.cache._cache.hasher.get_nodes(key, 2)
+        self.assertEqual(
+            self.cache._cache.clients[replica].get(key), {"temperature": 12}
+        )
+
+        self.cache._cache.clients[primary].flush_all()
+        self.assertEqual(self.cache.get("london"), {"temperature": 12})
+
+        self.cache.delete("london")
+        self.assertIsNone(self.cache.get("london"))
+
+    def test_replicas_of_cooled_keys_are_not_served_stale(self):
+        self.cache.get("london")
+        self.cache.get("london")
+        self.cache.set("london", {"temperature": 10})
+        self.cache.hot_keys.counts.clear()
+        self.cache.set("london", {"temperature": 12})
+
+        key = self.cache.make_key("london")
+        primary = self.cache._cache.hasher.get_node(key)
+        self.cache._cache.clients[primary].flush_all()
+
+        self.assertIsNone(self.cache.get("london"))
+        self.assertIsNone(self.cache.get("london"))
+
+    def test_cold_keys_skip_replicas(self):
+        key = self.cache.make_key("paris")
+        replica = self.cache._cache.hasher.get_nodes(key, 2)[1]
+        with patch.object(self.cache._cache.clients[replica], "delete") as mock_delete:
+            self.cache.set("paris", {"temperature": 20})
+        mock_delete.assert_not_called()
+
+        unreplicated = ShardedPyMemcacheCache(
+            self.nodes, {"OPTIONS": {**self.options, "replicas": 0}}
+        )
+        unreplicated._cache = self.cache._cache
+        with patch.object(unreplicated.hot_keys, "hit") as mock_hit:
+            self.assertEqual(unreplicated.get("paris"), {"temperature": 20})
+        mock_hit.assert_not_called()
+
+    def test_every_write_keeps_replicas_current(self):
+        for name in ("london", "hits"):
+            self.cache.get(name)
+            self.cache.get(name)
+        key = self.cache.make_key("london")
+        primary, replica = self.cache._cache.hasher.get_nodes(key, 2)
+        replica_client = self.cache._cache.clients[replica]
+
+        self.cache.set_many({"london": {"temperature": 10}})
+        self.assertEqual(replica_client.get(key), {"temperature": 10})
+
+        self.cache._cache.clients[primary].flush_all()
+        self.assertTrue(self.cache.add("london", {"temperature": 12}))
+        self.assertEqual(replica_client.get(key), {"temperature": 12})
+        self.assertTrue(self.cache.touch("london", 30))
+        self.assertEqual(replica_client.get(key), {"temperature": 12})
+
+        self.cache.delete_many(["london"])
+        self.assertIsNone(replica_client.get(key))
+
+        self.cache.set("hits", 1)
+        self.assertEqual(self.cache.incr("hits"), 2)
+        hits_key = self.cache.make_key("hits")
+        hits_primary = self.cache._cache.hasher.get_node(hits_key)
+        self.cache._cache.clients[hits_primary].flush_all()
+        self.assertIsNone(self.cache.get("hits"))
+
+    def test_ejection_is_shared_between_instances(self):
+        other = ShardedPyMemcacheCache(self.nodes, {"OPTIONS": self.options})
+        self.assertIs(other._cache, self.cache._cache)
+
+        key = self.cache.make_key("london")
+        primary = self.cache._cache.hasher.get_node(key)
+        host, port = primary.split(":")
+        self.cache._cache.clients[primary] = FailingMemcacheClient(
+            server=(host, int(port))
+        )
+
+        self.assertIsNone(self.cache.get("london"))
+
+        self.assertEqual(other.get_node_status()[primary]["state"], "ejected")
+        self.assertNotEqual(other._cache.hasher.get_node(key), primary)
+        other.set("london", {"temperature": 12})
+        self.assertEqual(other.get("london"), {"temperature": 12})
+
+    def test_node_failure_and_recovery_under_threads(self):
+        cache = ShardedPyMemcacheCache(
+            self.nodes,
+            {
+                "OPTIONS": {
+                    **self.options,
+                    "retry_attempts": 1,
+                    "retry_timeout": 0,
+                    "dead_timeout": 0,
+                    "use_pooling": False,
+                }
+            },
+        )
+        hash_client = cache._cache
+        # revived nodes are rebuilt with client_class
+        hash_client.client_class = FlakyMemcacheClient
+        hash_client.clients = {
+            node: FlakyMemcacheClient(server=(node.split(":")[0], 11211))
+            for node in self.nodes
+        }
+        cache.set("london", {"temperature": 12})
+        primary = hash_client.hasher.get_node(cache.make_key("london"))
+        errors = []
+        stop = threading.Event()
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    cache.get("london")
+                except Exception as error:
+                    errors.append(error)
+
+        threads = [threading.Thread(target=reader) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        FlakyMemcacheClient.down.add((primary.split(":")[0], 11211))
+        time.sleep(0.3)
+        FlakyMemcacheClient.down.clear()
+        time.sleep(0.1)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(set(hash_client.hasher.nodes), set(self.nodes))
+        cache.set("london", {"temperature": 13})
+        self.assertEqual(cache.get("london"), {"temperature": 13})
+
+    def test_node_status(self):
+        self.cache._cache.hasher.remove_node("cache1:11211")
+        self.cache._cache._dead_clients[("cache1", 11211)] = time.time()
+
+        status = self.cache.get_node_status()
+
+        self.assertEqual(status["cache1:11211"]["state"], "ejected")
+        self.assertEqual(status["cache2:11211"], {"ok": True, "state": "up"})
+
+
+class LoadTestCommandTest(unittest.TestCase):
+    def test_server_timing_round_trip(self):
+        value = format_server_timing({"cache": 0.0012, "geocode": 0.05})
+
+        self.assertEqual(value, "cache;dur=1.20, geocode;dur=50.00")
+        self.assertEqual(parse_server_timing(value), {"cache": 1.2, "geocode": 50.0})
+
+    def test_reservoir_is_bounded(self):
+        reservoir = Reservoir(size=100)
+        for value in range(10000):
+            reservoir.add(float(value))
+
+        self.assertEqual(len(reservoir.samples), 100)
+        self.assertEqual(reservoir.count, 10000)
+        self.assertEqual(reservoir.max, 9999.0)
+        self.assertAlmostEqual(reservoir.percentile(50), 5000, delta=1500)
+
+    def test_in_process_run_with_fake_upstream(self):
+        stdout = io.StringIO()
+
+        call_command(
+            "loadtest",
+            "--fake-upstream",
+            "--local-cache",
+            "--upstream-latency=0",
+            "--duration=0.5",
+            "--concurrency=2",
+            "--sample-interval=0.2",
+            stdout=stdout,
+        )
+
+        report = stdout.getvalue()
+        self.assertIn("Responses: 200:", report)
+        self.assertIn("weather_fetch", report)
+        self.assertIn("Growth:", report)
+
+    def test_invalid_options(self):
+        for option in ("--cities=0", "--concurrency=0", "--duration=0"):
+            with self.assertRaises(CommandError):
+                call_command("loadtest", option, stdout=io.StringIO())
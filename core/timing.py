@@ -0,0 +1,108 @@
+"""
+Module: timing.py
+Description: This module measures how long the stages of a request take (cache lookup, geocoding, upstream
+fetch, parsing, serialization) and reports them in the Server-Timing response header.
+
+Timing is only collected inside collect_stages(), which ServerTimingMiddleware enters when the
+SERVER_TIMING setting is on, so stage() costs next to nothing otherwise.
+
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+_stages = contextvars.ContextVar("core_timing_stages", default=None)
+
+
+@contextmanager
+def stage(name):
+    """
+    Adds the time spent in the block to the named stage of the current request, if timing is collected.
+    """
+    stages = _stages.get()
+    if stages is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+
+
+@contextmanager
+def collect_stages():
+    """
+    Collects the stages timed within the block into the yielded dictionary of stage name to seconds.
+    """
+    stages = {}
+    token = _stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _stages.reset(token)
+
+
+def format_server_timing(stages):
+    """
+    Formats stage durations (in seconds) as a Server-Timing header value.
+    """
+    return ", ".join(
+        f"{name};dur={duration * 1000:.2f}" for name, duration in stages.items()
+    )
+
+
+def parse_server_timing(value):
+    """
+    Parses a Server-Timing header value into a dictionary of stage name to milliseconds.
+    """
+    stages = {}
+    for metric in value.split(","):
+        name, *params = (part.strip() for part in metric.split(";"))
+        for param in params:
+            if param.startswith("dur="):
+                stages[name] = float(param[len("dur=") :])
+        if name and name not in stages:
+            stages[name] = 0.0
+    return stages
+
+
+class ServerTimingMiddleware:
+    """
+    Adds the durations of the request stages in a Server-Timing header when SERVER_TIMING is on.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.SERVER_TIMING:
+            return self.get_response(request)
+        with collect_stages() as stages:
+            response = self.get_response(request)
+        return self.add_header(response, stages)
+
+    async def __acall__(self, request):
+        if not settings.SERVER_TIMING:
+            return await self.get_response(request)
+        with collect_stages() as stages:
+            response = await self.get_response(request)
+        return self.add_header(response, stages)
+
+    @staticmethod
+    def add_header(response, stages):
+        if stages:
+            response["Server-Timing"] = format_server_timing(stages)
+        return response
@@ -1,9 +1,12 @@
 from django.urls import path
 
-from .views import WeatherAPIView
+from .views import ForecastAPIView, HealthView, WeatherAPIView, WeatherStreamView
 
 app_name = "core"
 
 urlpatterns = [
+    path("health/", HealthView.as_view(), name="health"),
+    path("weather-stream/", WeatherStreamView.as_view(), name="weather-stream"),
     path("weather/<str:city>/", WeatherAPIView.as_view(), name="weather-api"),
+    path("forecast/<str:city>/", ForecastAPIView.as_view(), name="forecast-api"),
 ]
@@ -1,25 +1,264 @@
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+import asyncio
+import time
+from datetime import date, datetime, timedelta, timezone
+
 from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_response_headers
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import gettext_lazy as _
+from django.views import View
+from django.views.decorators.cache import never_cache
 from rest_framework import generics, status
 from rest_framework.response import Response
 
-from .client import OpenWeatherMapClient
-from .serializers import WeatherSerializer
+from .caching import get_forecast, get_weather, slice_forecast
+from .events import get_broadcaster
+from .serializers import ForecastEntrySerializer, WeatherSerializer
+from .timing import stage
 
 
-@method_decorator(cache_page(settings.CACHE_SECONDS), name='dispatch')
 class WeatherAPIView(generics.RetrieveAPIView):
     serializer_class = WeatherSerializer
 
     def get(self, request, *args, **kwargs):
         city = self.kwargs.get("city")
-        client = OpenWeatherMapClient()
 
-        weather_data = client.get_weather(city)
+        weather_data = get_weather(city)
 
         if weather_data["error"]:
             return Response(data=weather_data, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = self.get_serializer(weather_data["data"])
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # the upstream observation time identifies the data, so polling clients
+        # can revalidate without the body being serialized again
+        observed_at = weather_data.get("dt")
+        etag = quote_etag(str(observed_at)) if observed_at else None
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=observed_at
+        )
+        if response is None:
+            with stage("serialize"):
+                data = self.get_serializer(weather_data["data"]).data
+            response = Response(data, status=status.HTTP_200_OK)
+
+        if etag:
+            response.headers["ETag"] = etag
+            response.headers["Last-Modified"] = http_date(observed_at)
+        patch_response_headers(response, int(weather_data["expires"] - time.time()))
+        return response
+
+
+class ForecastAPIView(generics.RetrieveAPIView):
+    """
+    Returns the 5 day / 3 hour forecast for a city.
+
+    Query parameters:
+    - hours (int): Only return the next given number of hours.
+    - date (str): Only return one day, "today", "tomorrow" or YYYY-MM-DD, in the city's local time.
+    - fields (str): Comma separated names of the fields to return.
+    """
+
+    serializer_class = ForecastEntrySerializer
+    max_hours = 120
+    step_seconds = 3 * 3600
+
+    def get(self, request, *args, **kwargs):
+        city = self.kwargs.get("city")
+
+        forecast_data = get_forecast(city)
+
+        if forecast_data["error"]:
+            return Response(data=forecast_data, status=status.HTTP_404_NOT_FOUND)
+
+        forecast = forecast_data["data"]
+        try:
+            start, end = self.get_window(forecast["timezone"])
+            fields = self.get_fields()
+        except ValueError as error:
+            return Response(
+                data={"error": True, "message": str(error), "data": None},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        entries = slice_forecast(forecast["entries"], start, end)
+        with stage("serialize"):
+            data = self.get_serializer(entries, many=True, fields=fields).data
+        return Response(
+            {"city": forecast["city"], "forecast": data},
+            status=status.HTTP_200_OK,
+        )
+
+    def get_window(self, utc_offset):
+        """
+        Returns the (start, end) unix timestamps requested through the hours and date parameters.
+        """
+        start = end = None
+        hours = self.request.query_params.get("hours")
+        if hours is not None:
+            if not hours.isdigit() or not 0 < int(hours) <= self.max_hours:
+                raise ValueError(
+                    _("hours must be between 1 and %(max)d.") % {"max": self.max_hours}
+                )
+            now = int(time.time())
+            # entries are keyed by the start of their 3 hour step, include the
+            # step that is in progress
+            start = now - self.step_seconds + 1
+            end = now + int(hours) * 3600
+
+        day = self.request.query_params.get("date")
+        if day is not None:
+            local_tz = timezone(timedelta(seconds=utc_offset))
+            today = datetime.now(local_tz).date()
+            if day == "today":
+                day = today
+            elif day == "tomorrow":
+                day = today + timedelta(days=1)
+            else:
+                try:
+                    day = date.fromisoformat(day)
+                except ValueError:
+                    raise ValueError(
+                        _("date must be today, tomorrow or YYYY-MM-DD.")
+                    ) from None
+            day_start = int(
+                datetime(day.year, day.month, day.day, tzinfo=local_tz).timestamp()
+            )
+            start = max(start or day_start, day_start)
+            end = min(end or day_start + 86400, day_start + 86400)
+
+        return start, end
+
+    def get_fields(self):
+        """
+        Returns the field names requested through the fields parameter, None meaning all fields.
+        """
+        fields = self.request.query_params.get("fields")
+        if not fields:
+            return None
+        fields = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = fields - set(self.serializer_class().fields)
+        if unknown:
+            raise ValueError(
+                _("Unknown fields: %(fields)s.")
+                % {"fields": ", ".join(sorted(unknown))}
+            )
+        return fields
+
+
+class WeatherStreamView(View):
+    """
+    Streams weather updates for a set of cities as Server-Sent Events.
+
+    The cities are given as a comma separated ``cities`` query parameter. A message is sent
+    whenever the weather of one of them changes. Streaming requires serving the project over ASGI,
+    WSGI requests get a 501.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        cities = sorted(
+            {
+                city.strip().lower()
+                for city in request.GET.get("cities", "").split(",")
+                if city.strip()
+            }
+        )
+        if not cities or len(cities) > settings.WEATHER_STREAM_MAX_CITIES:
+            return JsonResponse(
+                {
+                    "error": True,
+                    "message": _("Provide between 1 and %(max)d cities.")
+                    % {"max": settings.WEATHER_STREAM_MAX_CITIES},
+                    "data": None,
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not isinstance(request, ASGIRequest):
+            # under WSGI the whole stream would be read before sending anything
+            return JsonResponse(
+                {
+                    "error": True,
+                    "message": _("The weather stream requires an ASGI server."),
+                    "data": None,
+                },
+                status=status.HTTP_501_NOT_IMPLEMENTED,
+            )
+
+        response = StreamingHttpResponse(
+            self.stream(cities), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def stream(self, cities):
+        broadcaster = get_broadcaster()
+        queue = broadcaster.subscribe(cities)
+        loop = asyncio.get_running_loop()
+        # Django 4.2 doesn't cancel the stream when the client goes away, so an
+        # abandoned stream keeps its subscription (and the city refreshers)
+        # alive until the deadline. Keep it short, EventSource clients
+        # reconnect on their own after WEATHER_STREAM_RETRY_MS.
+        deadline = loop.time() + settings.WEATHER_STREAM_MAX_AGE
+        try:
+            yield f"retry: {settings.WEATHER_STREAM_RETRY_MS}\n\n".encode()
+            while loop.time() < deadline:
+                try:
+                    yield await asyncio.wait_for(
+                        queue.get(), settings.WEATHER_STREAM_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            broadcaster.unsubscribe(queue, cities)
+
+
+@method_decorator(never_cache, name="dispatch")
+class HealthView(View):
+    """
+    Readiness check for load balancers and orchestrators.
+
+    Checks the database and the cache, each bounded by the connection timeouts configured in
+    settings, and answers 200 when both are reachable or 503 otherwise.
+    """
+
+    def get(self, request, *args, **kwargs):
+        checks = {
+            "database": self.run_check(self.check_database),
+            "cache": self.run_check(self.check_cache),
+        }
+        healthy = all(check["ok"] for check in checks.values())
+        return JsonResponse(
+            {"status": "ok" if healthy else "unavailable", "checks": checks},
+            status=(
+                status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE
+            ),
+        )
+
+    @staticmethod
+    def run_check(check):
+        started = time.monotonic()
+        try:
+            result = {"ok": True, **(check() or {})}
+        except Exception as error:
+            result = {"ok": False, "error": error.__class__.__name__}
+        result["ms"] = round((time.monotonic() - started) * 1000, 1)
+        return result
+
+    @staticmethod
+    def check_database():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    @staticmethod
+    def check_cache():
+        cache.set("core:health", 1, 10)
+        if cache.get("core:health") != 1:
+            raise RuntimeError("cache read back failed")
+        if hasattr(cache, "get_node_status"):
+            return {"nodes": cache.get_node_status()}
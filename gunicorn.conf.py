@@ -0,0 +1,46 @@
+"""
+Gunicorn configuration for serving the weather project in production.
+
+Run with:
+    gunicorn -c gunicorn.conf.py
+
+Every setting can be overridden from the environment. The app is preloaded in the
+master process so workers fork with Django already imported and share that memory.
+Because of the preload, a HUP only restarts the workers on the already loaded code;
+to deploy new code without dropping requests send USR2 to the master, then QUIT to
+the old master once the new workers are up.
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = os.environ.get("GUNICORN_APP", "weather.asgi:application")
+# uvicorn workers serve the ASGI app. "gthread" with
+# GUNICORN_APP=weather.wsgi:application also serves the JSON endpoints, but not
+# the weather stream: under WSGI it answers 501, since Django would read the
+# whole stream before sending anything and hold a worker thread meanwhile.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "uvicorn.workers.UvicornWorker")
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# only used by the gthread worker class
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+preload_app = True
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+# recycle workers now and then so slow leaks can't grow without bound
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 10000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 1000))
+
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-")
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOGLEVEL", "info")
+
+
+def post_fork(server, worker):
+    # connections opened while preloading must not be shared between workers
+    from django.db import connections
+
+    connections.close_all()
@@ -7,15 +7,15 @@ import environ
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 # Environment variables
-env = environ.Env(
-    # set casting, default value
-    DEBUG=(bool, True),
-    DEBUG_TOOLBAR=(bool, True),
-)
+env = environ.Env()
 
 # reading .env.docker file
 environ.Env.read_env(os.path.join(BASE_DIR, ".env.docker"))
 
+# "production" switches the defaults below to a lean, non-debug setup for workers
+SETTINGS_PROFILE = env("SETTINGS_PROFILE", default="development")
+PRODUCTION = SETTINGS_PROFILE == "production"
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = env(
     "SECRET_KEY",
@@ -23,7 +23,7 @@ SECRET_KEY = env(
 )
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = env("DEBUG")
+DEBUG = env.bool("DEBUG", default=not PRODUCTION)
 
 ALLOWED_HOSTS = tuple(env.list("ALLOWED_HOSTS", default=["*"]))
 
@@ -39,15 +39,31 @@ INSTALLED_APPS = [
     # 3rd party
     "rest_framework",
     "rest_framework.authtoken",
-    "django_extensions",
-    "modeltranslation",
-    "django_countries",
-    "drf_spectacular",
+]
+
+# Apps the weather API doesn't need at runtime. They are only imported when
+# listed here, so production workers skip them by default.
+OPTIONAL_APPS = env.list(
+    "OPTIONAL_APPS",
+    default=(
+        []
+        if PRODUCTION
+        else [
+            "django_extensions",
+            "modeltranslation",
+            "django_countries",
+            "drf_spectacular",
+        ]
+    ),
+)
+
+INSTALLED_APPS += OPTIONAL_APPS + [
     # Local
     "core",
 ]
 
 MIDDLEWARE = [
+    "core.timing.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -57,8 +73,11 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Report request stage durations in a Server-Timing header
+SERVER_TIMING = env.bool("SERVER_TIMING", default=DEBUG)
+
 # Debug Toolbar
-DEBUG_TOOLBAR = env("DEBUG_TOOLBAR")
+DEBUG_TOOLBAR = env.bool("DEBUG_TOOLBAR", default=not PRODUCTION)
 
 if DEBUG and DEBUG_TOOLBAR:
     INTERNAL_IPS = [
@@ -101,6 +120,11 @@ DATABASES = {
         default=f"sqlite:///{SQLITE_PATH}"
     ),  # 'default': env.db('SQLITE_URL')
 }
+# bound how long a request (or the health check) can hang on an unreachable database
+if DATABASES["default"]["ENGINE"] == "django.db.backends.postgresql":
+    DATABASES["default"].setdefault("OPTIONS", {}).setdefault(
+        "connect_timeout", env.int("DB_CONNECT_TIMEOUT", default=3)
+    )
 
 # Password validation
 # https://docs.weather.com/en/5.0/ref/settings/#auth-password-validators
@@ -154,7 +178,11 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.SessionAuthentication",
         "rest_framework.authentication.TokenAuthentication",
     ),
-    "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    "DEFAULT_SCHEMA_CLASS": (
+        "drf_spectacular.openapi.AutoSchema"
+        if "drf_spectacular" in INSTALLED_APPS
+        else "rest_framework.schemas.openapi.AutoSchema"
+    ),
 }
 
 LOGGING = {
@@ -194,13 +222,29 @@ LOGGING = {
         },
     },
 }
-CACHE_SECONDS = env("CACHE_SECONDS", default=300)
+CACHE_SECONDS = env.int("CACHE_SECONDS", default=300)
+FORECAST_CACHE_SECONDS = env.int("FORECAST_CACHE_SECONDS", default=1800)
+GEOCODE_CACHE_SECONDS = env.int("GEOCODE_CACHE_SECONDS", default=60 * 60 * 24)
 
+# CACHE_URL may list several memcached nodes, e.g. memcache://cache1:11211,cache2:11211
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.memcached.PyMemcacheCache",
-        'LOCATION': env.cache_url()['LOCATION'],
+        "BACKEND": "core.cache_backends.ShardedPyMemcacheCache",
+        "LOCATION": env.cache_url()["LOCATION"],
         "TIMEOUT": CACHE_SECONDS,
+        "OPTIONS": {
+            "connect_timeout": env.float("CACHE_CONNECT_TIMEOUT", default=1),
+            "timeout": env.float("CACHE_SOCKET_TIMEOUT", default=1),
+            # a failing node is retried retry_attempts times, then ejected for
+            # dead_timeout seconds while its keys move to the other nodes
+            "ignore_exc": env.bool("CACHE_IGNORE_EXC", default=True),
+            "retry_attempts": env.int("CACHE_RETRY_ATTEMPTS", default=2),
+            "retry_timeout": env.float("CACHE_RETRY_TIMEOUT", default=1),
+            "dead_timeout": env.float("CACHE_DEAD_TIMEOUT", default=30),
+            "replicas": env.int("CACHE_HOT_KEY_REPLICAS", default=0),
+            "hot_key_threshold": env.int("CACHE_HOT_KEY_THRESHOLD", default=100),
+            "hot_key_window": env.int("CACHE_HOT_KEY_WINDOW", default=60),
+        },
     }
 }
 
@@ -211,3 +255,13 @@ OPEN_WEATHER_API_KEY = env(
     "OPEN_WEATHER_API_KEY", default="40e81b0386bf3086563e5fe4ec67e22b"
 )
 BASE_API_URL = env("BASE_API_URL", default="http://api.openweathermap.org/")
+
+# Server-Sent Events weather stream
+WEATHER_STREAM_INTERVAL = env.int("WEATHER_STREAM_INTERVAL", default=60)
+WEATHER_STREAM_KEEPALIVE = env.int("WEATHER_STREAM_KEEPALIVE", default=15)
+# Django doesn't stop a stream when its client disconnects, so an abandoned
+# stream keeps its refreshers running until this many seconds have passed
+WEATHER_STREAM_MAX_AGE = env.int("WEATHER_STREAM_MAX_AGE", default=60)
+WEATHER_STREAM_MAX_CITIES = env.int("WEATHER_STREAM_MAX_CITIES", default=20)
+WEATHER_STREAM_QUEUE_SIZE = env.int("WEATHER_STREAM_QUEUE_SIZE", default=100)
+WEATHER_STREAM_RETRY_MS = env.int("WEATHER_STREAM_RETRY_MS", default=5000)